@@ -13,6 +13,8 @@ if not os.path.isfile(k_settings_file_path):
 
 g_settings = None
 
+k_seconds_per_day = 24 * 60 * 60
+
 def pretty_time(seconds):
     minutes, seconds = divmod(seconds, 60)
     hours, minutes = divmod(minutes, 60)
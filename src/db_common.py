@@ -5,14 +5,39 @@ import time
 import logging
 import sqlite3
 import datetime
+import contextlib
+import calendar
+import numbers
 
 from common import pretty_time
 import common
 import db_definition
+import review_tagger
 
 g_debug_mode = False
+g_review_tagger = None
+g_bulk_load = None
 reviews_to_insert = []
 BATCH_SIZE = 1000 
+k_db_file = "steam.db"
+k_review_storage_version = 1
+k_db_catalog_file = "steam_catalog.db"
+k_db_shard_file_format = "steam_{0}.db"
+k_catalog_table_names = [
+    "stats_steam_games",
+    "stats_steam_languages",
+    "stats_steam_review_issues",
+    "stats_users"
+]
+k_app_table_names = [
+    "stats_events",
+    "stats_steam_player_count",
+    "stats_steam_reviews",
+    "stats_steam_review_changes",
+    "stats_scrape_checkpoints",
+    "stats_scrape_seen_reviews",
+    "stats_bulk_loads"
+]
 
 def set_debug(debug_on):
     global g_debug_mode
@@ -41,10 +66,210 @@ def insert_or_update_languages(lang_key, name, steam_key):
     data = (lang_key, name, steam_key)
     run_db_query(upsert_query, data)
 
-def delete_review(review_id):
-    run_db_query("DELETE FROM stats_steam_reviews WHERE id = ?;", (review_id,))
+def delete_review(review_id, steam_appid=None):
+    with db_transaction(steam_appid) as c:
+        c.execute("INSERT INTO stats_steam_review_changes (review_id, steam_appid, change_type, recommended, time_stamp) SELECT id, steam_appid, ?, recommended, ? FROM stats_steam_reviews WHERE id = ?;", (k_change_deleted, int(time.time()), review_id))
+        c.execute("DELETE FROM stats_steam_reviews WHERE id = ?;", (review_id,))
+
+k_change_created = "created"
+k_change_deleted = "deleted"
+k_change_vote = "vote_changed"
+k_change_text = "text_edited"
+k_change_response = "developer_response"
+k_change_lookup_chunk = 500 # Stays below SQLite's default limit of 999 variables per statement
+
+def _as_text(value):
+    # Stored text comes back as utf-8 bytes on python 2, the API gives us unicode
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return value
+
+def get_existing_reviews(c, review_ids):
+    ''' Returns review id -> (recommended, review_text, responded_by, issue_list, can_be_turned) of the given reviews that
+    are already stored, read on the batch transaction cursor c.
+    '''
+    existing = {}
+    for start in range(0, len(review_ids), k_change_lookup_chunk):
+        chunk = review_ids[start:start + k_change_lookup_chunk]
+        c.execute("SELECT id, recommended, review_text, responded_by, issue_list, can_be_turned FROM stats_steam_reviews WHERE id IN ({0});".format(", ".join(["?"] * len(chunk))), chunk)
+        for row in c.fetchall():
+            existing[row[0]] = row[1:]
+    return existing
+
+def log_review_changes(c, columns, rows, existing):
+    ''' Appends a stats_steam_review_changes record for every review in rows that is new, flipped its vote, had its text
+    edited or got a developer response. Must run on the batch transaction cursor c before the rows are written.
+    - columns: column names of the row tuples
+    - existing: stored versions of the reviews, see get_existing_reviews
+    '''
+    id_index = columns.index("id")
+    appid_index = columns.index("steam_appid")
+    recommended_index = columns.index("recommended")
+    text_index = columns.index("review_text")
+    response_index = columns.index("responded_by")
+
+    existing = dict(existing)
+    now = int(time.time())
+    changes = []
+    for row in rows:
+        review_id = int(row[id_index])
+        recommended = bool(row[recommended_index])
+        old = existing.get(review_id)
+        if old is None:
+            changes.append((review_id, row[appid_index], k_change_created, recommended, now))
+        else:
+            old_recommended, old_text, old_response = old[:3]
+            if bool(old_recommended) != recommended:
+                changes.append((review_id, row[appid_index], k_change_vote, recommended, now))
+            if _as_text(old_text) != _as_text(row[text_index]):
+                changes.append((review_id, row[appid_index], k_change_text, recommended, now))
+            if old_response is None and row[response_index] is not None:
+                changes.append((review_id, row[appid_index], k_change_response, recommended, now))
+        # The same review can show up twice in one batch, later copies are compared against the earlier one
+        existing[review_id] = (recommended, row[text_index], row[response_index])
+
+    c.executemany("INSERT INTO stats_steam_review_changes (review_id, steam_appid, change_type, recommended, time_stamp) VALUES (?, ?, ?, ?, ?);", changes)
+
+def get_or_create_issue_ids(names):
+    ''' Returns issue name -> stats_steam_review_issues id, adding the issues that don't exist yet. '''
+    # name is unique, so workers adding the same issue at the same time all end up with the one row. Catalogs with
+    # duplicate names don't get the unique index (see create_catalog_tables), the NOT EXISTS keeps them from growing.
+    run_db_query("INSERT OR IGNORE INTO stats_steam_review_issues (name) SELECT ? WHERE NOT EXISTS (SELECT 1 FROM stats_steam_review_issues WHERE name = ?);", [(name, name) for name in names], many=True)
+    # Ordered so the lowest id of a duplicate name wins
+    return {name: issue_id for issue_id, name in run_db_query("SELECT id, name FROM stats_steam_review_issues ORDER BY id DESC;")}
+
+def get_review_tagger():
+    ''' Returns the IssueTagger for the issue_rules in the settings, or None if there are no rules. '''
+    global g_review_tagger
+    if g_review_tagger is None:
+        rules = review_tagger.get_issue_rules()
+        if not rules:
+            return None
+        g_review_tagger = review_tagger.IssueTagger(rules, get_or_create_issue_ids(review_tagger.get_issue_names(rules)))
+    return g_review_tagger
 
-def maybe_insert_batch_reviews(include_user_input_columns=False, force_insert=False):
+def tag_reviews(tagger, columns, rows, existing):
+    ''' Returns rows with issue_list and can_be_turned appended. Both are carried over from the stored review, and new
+    or edited reviews get the issues the tagger finds added to their issue_list.
+    '''
+    id_index = columns.index("id")
+    text_index = columns.index("review_text")
+    lang_index = columns.index("lang_key")
+
+    tagged_rows = []
+    for row in rows:
+        issue_list, can_be_turned = None, False
+        old = existing.get(int(row[id_index]))
+        if old is not None:
+            issue_list, can_be_turned = old[3], old[4]
+        if tagger is not None and (old is None or _as_text(old[1]) != _as_text(row[text_index])):
+            issue_list = review_tagger.merge_issue_list(issue_list, tagger.tag(row[lang_index], row[text_index]))
+        tagged_rows.append(tuple(row) + (issue_list, can_be_turned))
+    return tagged_rows
+
+def check_change_log_appid(steam_appid):
+    # The catalog has no change log, in the sharded layout it is only found in the app databases
+    if steam_appid is None and is_sharded():
+        raise ValueError("The change log is kept per app database in the sharded layout, steam_appid is required")
+
+def get_review_changes(consumer_name, limit=1000, steam_appid=None):
+    ''' Returns up to limit change records (seq, review_id, steam_appid, change_type, recommended, time_stamp) after the
+    consumer's stored offset, oldest first. The offset only moves with set_review_changes_offset.
+    In the sharded layout every app database has its own log and offsets, so steam_appid picks the one to read and is
+    required there, like for the other change log functions.
+    '''
+    check_change_log_appid(steam_appid)
+    q_offset = run_db_query("SELECT last_seq FROM stats_review_change_consumers WHERE name = ?;", (consumer_name,), steam_appid=steam_appid)
+    last_seq = q_offset[0][0] if q_offset else 0
+    return run_db_query("SELECT seq, review_id, steam_appid, change_type, recommended, time_stamp FROM stats_steam_review_changes WHERE seq > ? ORDER BY seq LIMIT ?;", (last_seq, limit), steam_appid=steam_appid)
+
+def get_review_changes_since(seq, limit=1000, steam_appid=None):
+    ''' Returns up to limit change records after seq, oldest first, for readers that keep their own offset.
+    If steam_appid is given only the changes of that app are returned.
+    '''
+    check_change_log_appid(steam_appid)
+    if steam_appid is None:
+        return run_db_query("SELECT seq, review_id, steam_appid, change_type, recommended, time_stamp FROM stats_steam_review_changes WHERE seq > ? ORDER BY seq LIMIT ?;", (seq, limit))
+    return run_db_query("SELECT seq, review_id, steam_appid, change_type, recommended, time_stamp FROM stats_steam_review_changes WHERE seq > ? AND steam_appid = ? ORDER BY seq LIMIT ?;", (seq, steam_appid, limit), steam_appid=steam_appid)
+
+def get_last_review_change_seq(steam_appid=None):
+    check_change_log_appid(steam_appid)
+    q_seq = run_db_query("SELECT max(seq) FROM stats_steam_review_changes;", steam_appid=steam_appid)
+    return q_seq[0][0] or 0
+
+def set_review_changes_offset(consumer_name, seq, steam_appid=None):
+    check_change_log_appid(steam_appid)
+    run_db_query("INSERT OR REPLACE INTO stats_review_change_consumers (name, last_seq, time_stamp) VALUES (?, ?, ?);", (consumer_name, seq, int(time.time())), steam_appid=steam_appid)
+
+def consume_review_changes(consumer_name, handler, batch_size=1000, steam_appid=None):
+    ''' Calls handler with each batch of change records the consumer hasn't processed yet, storing the new offset after
+    every batch the handler returns from. Returns the number of records processed.
+    '''
+    check_change_log_appid(steam_appid)
+    num_processed = 0
+    while True:
+        changes = get_review_changes(consumer_name, batch_size, steam_appid)
+        if not changes:
+            return num_processed
+        handler(changes)
+        set_review_changes_offset(consumer_name, changes[-1][0], steam_appid)
+        num_processed = num_processed + len(changes)
+
+class ScrapeCheckpoint(object):
+    ''' Where a review_parse_loop run got to, stored together with every committed batch so a restarted run can resume.
+    - cursor: the next cursor to request from the API
+    - sort_filter / languages: the partition the cursor belongs to, a cursor is only valid for the same query
+    '''
+    def __init__(self, steam_appid, sort_filter, languages, cursor, page_count, num_added, time_stamp=None):
+        self.steam_appid = steam_appid
+        self.sort_filter = sort_filter
+        self.languages = languages
+        self.cursor = cursor
+        self.page_count = page_count
+        self.num_added = num_added
+        self.time_stamp = time_stamp
+
+def get_scrape_checkpoint(steam_appid, sort_filter, languages, max_age_seconds):
+    ''' Returns the stored ScrapeCheckpoint for the app, or None if there is none we can resume from.
+    Checkpoints older than max_age_seconds or made for another sort filter / language set are discarded, together with their seen review IDs.
+    '''
+    rows = run_db_query("SELECT sort_filter, languages, cursor, page_count, num_added, time_stamp FROM stats_scrape_checkpoints WHERE steam_appid = ?;", (steam_appid,), steam_appid=steam_appid)
+    if rows:
+        checkpoint = ScrapeCheckpoint(steam_appid, *rows[0])
+        age = time.time() - checkpoint.time_stamp
+        if checkpoint.sort_filter == sort_filter and checkpoint.languages == languages and age <= max_age_seconds:
+            return checkpoint
+        logging.info("Discarding scrape checkpoint for {0} (age {1}, filter {2})".format(steam_appid, common.pretty_time(age), checkpoint.sort_filter))
+    clear_scrape_checkpoint(steam_appid)
+    return None
+
+def get_scrape_seen_review_ids(steam_appid):
+    rows = run_db_query("SELECT review_id FROM stats_scrape_seen_reviews WHERE steam_appid = ?;", (steam_appid,), steam_appid=steam_appid)
+    return {row[0] for row in rows}
+
+def clear_scrape_checkpoint(steam_appid):
+    with db_transaction(steam_appid) as c:
+        c.execute("DELETE FROM stats_scrape_checkpoints WHERE steam_appid = ?;", (steam_appid,))
+        c.execute("DELETE FROM stats_scrape_seen_reviews WHERE steam_appid = ?;", (steam_appid,))
+
+def save_scrape_checkpoint(c, checkpoint, review_ids):
+    ''' Stores the checkpoint and the IDs of the reviews written with it, using the cursor c of the batch transaction. '''
+    c.execute("INSERT OR REPLACE INTO stats_scrape_checkpoints (steam_appid, sort_filter, languages, cursor, page_count, num_added, time_stamp) VALUES (?, ?, ?, ?, ?, ?, ?);", (
+        checkpoint.steam_appid,
+        checkpoint.sort_filter,
+        checkpoint.languages,
+        checkpoint.cursor,
+        checkpoint.page_count,
+        checkpoint.num_added,
+        int(time.time())
+    ))
+    c.executemany("INSERT OR IGNORE INTO stats_scrape_seen_reviews (steam_appid, review_id) VALUES (?, ?);", [(checkpoint.steam_appid, review_id) for review_id in review_ids])
+
+def maybe_insert_batch_reviews(include_user_input_columns=False, force_insert=False, checkpoint=None):
+    ''' Writes the pending reviews once there are BATCH_SIZE of them, or bulk_load_batch_size during a bulk load (or any,
+    if force_insert is set).
+    - checkpoint: ScrapeCheckpoint committed in the same transaction as the batch
+    '''
     global reviews_to_insert
     all_columns = [
         "id",
@@ -53,7 +278,6 @@ def maybe_insert_batch_reviews(include_user_input_columns=False, force_insert=Fa
         "user_name",
         "review_text",
         "hours_played",
-        "review_url",
         "date_posted",
         "date_updated",
         "helpful_amount",
@@ -70,19 +294,43 @@ def maybe_insert_batch_reviews(include_user_input_columns=False, force_insert=Fa
     else:
         extended_columns = all_columns
 
-    if len(reviews_to_insert) >= BATCH_SIZE or (force_insert and reviews_to_insert):
+    batch_size = g_bulk_load.batch_size if g_bulk_load is not None else BATCH_SIZE
+    if len(reviews_to_insert) >= batch_size or (force_insert and reviews_to_insert):
+        # REPLACE rewrites the whole row, so without user input the stored issue_list and can_be_turned are written back
+        written_columns = extended_columns if include_user_input_columns else all_columns + ["issue_list", "can_be_turned"]
         upsert_query = "INSERT OR REPLACE INTO stats_steam_reviews ({0}) VALUES ({1});".format(
-            ", ".join(extended_columns), ", ".join(["?"] * len(extended_columns))
+            ", ".join(written_columns), ", ".join(["?"] * len(written_columns))
         )
-        # Insert the batch of reviews
-        run_db_query(upsert_query, reviews_to_insert, many=True)
+        # Set up before the batch transaction, it may have to add issues to the catalog
+        tagger = get_review_tagger()
+
+        # Insert the batch of reviews, one transaction per app database
+        reviews_by_app = {}
+        for review_data in reviews_to_insert:
+            reviews_by_app.setdefault(int(review_data[1]), []).append(review_data)
+        for steam_appid, app_reviews in reviews_by_app.items():
+            if g_bulk_load is not None and g_bulk_load.steam_appid == steam_appid:
+                # Sorting only orders the rows within this batch, so its inserts touch neighbouring b-tree pages.
+                # The API pages come newest first, so a later batch mostly has lower ids and lands before this one.
+                app_reviews.sort(key=lambda review_data: int(review_data[0]))
+            with db_transaction(steam_appid) as c:
+                existing = get_existing_reviews(c, [int(review_data[0]) for review_data in app_reviews])
+                log_review_changes(c, extended_columns, app_reviews, existing)
+                if include_user_input_columns:
+                    c.executemany(upsert_query, app_reviews)
+                else:
+                    c.executemany(upsert_query, tag_reviews(tagger, extended_columns, app_reviews, existing))
+                if checkpoint is not None and int(checkpoint.steam_appid) == steam_appid:
+                    save_scrape_checkpoint(c, checkpoint, [review_data[0] for review_data in app_reviews])
         reviews_to_insert = []
 
 
-def insert_or_update_reviews(reviews, include_user_input_columns=False):
+def insert_or_update_reviews(reviews, include_user_input_columns=False, checkpoint=None):
     ''' Inserts (or updates if the ID already exists) the given reviews into the DB.
     - reviews: list of SteamReview
     - include_user_input_columns: If true, the issue_list and can_be_turned columns will also be set, else we don't update those.
+    - checkpoint: ScrapeCheckpoint describing the scrape position after these reviews. The batch is only flushed after
+      all given reviews are queued, so a committed checkpoint never points past a review that is still pending.
     '''
     all_columns = [
         "id",
@@ -91,7 +339,6 @@ def insert_or_update_reviews(reviews, include_user_input_columns=False):
         "user_name",
         "review_text",
         "hours_played",
-        "review_url",
         "date_posted",
         "date_updated",
         "helpful_amount",
@@ -122,24 +369,23 @@ def insert_or_update_reviews(reviews, include_user_input_columns=False):
         review_data  = (
             review.id,
             review.steam_appid,
-            review.recommended,
-            review.user_name,
+            int(review.recommended),
+            int(review.user_name) if review.user_name is not None else None,
             review.content,
             review.hours_played,
-            review.review_url,
-            review.date_posted,
-            review.date_updated,
+            to_epoch(review.date_posted),
+            to_epoch(review.date_updated),
             review.helpful_amount,
             review.helpful_total,
             review.games_owned,
             review.responded_by,
-            review.responded_date,
+            to_epoch(review.responded_date),
             review.language_key,
-            review.received_compensation
+            int(review.received_compensation) if review.received_compensation is not None else None
         )
         if include_user_input_columns:
             review_data += (
-                review.can_be_turned,
+                int(bool(review.can_be_turned)),
                 review.issue_list,
             )
         data_to_insert.append(review_data)
@@ -149,7 +395,56 @@ def insert_or_update_reviews(reviews, include_user_input_columns=False):
         global reviews_to_insert
         reviews_to_insert.append(review_data)
 
-        maybe_insert_batch_reviews(include_user_input_columns)
+    maybe_insert_batch_reviews(include_user_input_columns, checkpoint=checkpoint)
+
+k_date_formats = [
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d"
+]
+
+def to_epoch(value):
+    ''' Returns value as unix epoch seconds. Naive datetimes and date strings are taken as local time, like the
+    datetime.fromtimestamp values the scraper produces.
+    '''
+    if value is None or isinstance(value, numbers.Integral):
+        return value
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            return calendar.timegm(value.utctimetuple())
+        return int(time.mktime(value.timetuple()))
+    for date_format in k_date_formats:
+        try:
+            return int(time.mktime(time.strptime(value, date_format)))
+        except ValueError:
+            pass
+    raise ValueError("Unknown date format '{0}'".format(value))
+
+def epoch_sql(expression):
+    ''' Returns SQL converting expression to unix epoch seconds. Integers are kept, datetime text in any format SQLite
+    understands (fractional seconds, "T" separator) is taken as local time like to_epoch does, anything else gives NULL.
+    '''
+    return "(CASE WHEN typeof({0}) = 'integer' THEN {0} ELSE CAST(strftime('%s', {0}, 'utc') AS INTEGER) END)".format(expression)
+
+def epoch_param(value):
+    ''' Returns (SQL placeholder, value) to bind value as unix epoch seconds. Date strings are converted by SQLite, so
+    every format epoch_sql accepts works, numbers and datetimes go through to_epoch.
+    '''
+    if isinstance(value, (numbers.Integral, datetime.datetime)):
+        return "?", to_epoch(value)
+    return "CAST(strftime('%s', ?, 'utc') AS INTEGER)", value
+
+# Select expressions that give the review columns back in their original shape: the steamid as text, datetime text
+# in local time and the review url, which isn't stored anymore
+k_compat_columns = {
+    "user_name": "CAST({t}user_name AS TEXT)",
+    "review_url": "'https://steamcommunity.com/profiles/' || {t}user_name || '/recommended/' || {t}steam_appid",
+    "date_posted": "datetime({t}date_posted, 'unixepoch', 'localtime')",
+    "date_updated": "datetime({t}date_updated, 'unixepoch', 'localtime')",
+    "responded_timestamp": "datetime({t}responded_timestamp, 'unixepoch', 'localtime')"
+}
+
+def compat_column(column, table_alias=""):
+    return k_compat_columns.get(column, "{t}" + column).format(t=table_alias)
 
 k_columns = [
     "id",
@@ -167,17 +462,21 @@ k_columns = [
     "issue_list",
     "responded_timestamp"
 ]
-k_columns = ["re." + col for col in k_columns]
 k_order_modes = [
     "desc",
     "asc"
 ]
 
 def get_reviews(steam_appid, page_number, reviews_per_page, sort_by, sort_order, can_be_turned, vote, hide_never_updated, has_response, only_resolved_issues, only_updated_after_response, response_by, lang_key, issue_list, from_date, until_date):
-    column_str = ", ".join(k_columns)
+    column_str = ", ".join([compat_column(col, "re.") for col in k_columns])
 
-    sort_by_column = "re." + sort_by
-    sort_by_col = sort_by_column if sort_by_column in k_columns else "re.date_posted"
+    if sort_by not in k_columns:
+        sort_by_col = "re.date_posted"
+    elif sort_by == "review_url":
+        sort_by_col = compat_column(sort_by, "re.")
+    else:
+        # The stored integers sort the same way as the text they are returned as
+        sort_by_col = "re." + sort_by
     sort_by_order = sort_order if sort_order in k_order_modes else k_order_modes[0]
     order_by_str = "ORDER BY {col} {order}".format(col=sort_by_col, order=sort_by_order)
 
@@ -190,19 +489,24 @@ def get_reviews(steam_appid, page_number, reviews_per_page, sort_by, sort_order,
         where_clauses.append("re.lang_key = ?")
 
     if from_date:
-        where_clauses.append("re.date_posted >= '{0}'".format(from_date))
+        placeholder, value = epoch_param(from_date)
+        where_clauses.append("re.date_posted >= " + placeholder)
+        variables = variables + (value,)
 
     if until_date:
-        where_clauses.append("re.date_posted <= '{0}'".format(until_date))
+        placeholder, value = epoch_param(until_date)
+        where_clauses.append("re.date_posted <= " + placeholder)
+        variables = variables + (value,)
 
     if hide_never_updated:
         where_clauses.append("re.date_updated IS NOT NULL")
 
+    # issue_list is a JSON array of stats_steam_review_issues ids
     if only_resolved_issues:
-        where_clauses.append("0 < (select min(resolved_status) from unnest(re.issue_list) as rel(id) left join stats_steam_review_issues as ri on ri.id = rel.id)")
+        where_clauses.append("0 < (SELECT min(ri.resolved_status) FROM json_each(re.issue_list) AS rel LEFT JOIN stats_steam_review_issues AS ri ON ri.id = rel.value)")
     elif issue_list:
-        id_array = ",".join(issue_list)
-        where_clauses.append("exists (select rel.id from unnest(re.issue_list) as rel(id) intersect select ri.id from unnest(array[{0}]) as ri(id))".format(id_array))
+        where_clauses.append("EXISTS (SELECT 1 FROM json_each(re.issue_list) AS rel WHERE rel.value IN ({0}))".format(", ".join(["?"] * len(issue_list))))
+        variables = variables + tuple(int(issue_id) for issue_id in issue_list)
 
     if only_updated_after_response:
         where_clauses.append("re.date_updated > re.responded_timestamp")
@@ -241,14 +545,15 @@ def get_reviews(steam_appid, page_number, reviews_per_page, sort_by, sort_order,
     count_reviews_query = get_reviews_select_query("count(id)", where_str, "", "")
     count_positive_reviews_query = get_reviews_select_query("sum(cast(re.recommended as integer))", where_str, "", "")
 
-    reviews = run_db_query(select_reviews_query, variables + pagination_variables)
-    query_result_count = run_db_query(count_reviews_query, variables)[0][0]
-    positive_review_count = run_db_query(count_positive_reviews_query, variables)[0][0] or 0
+    # only_resolved_issues reads stats_steam_review_issues, which is in the catalog in the sharded layout
+    reviews = run_db_query(select_reviews_query, variables + pagination_variables, steam_appid=steam_appid, attach_catalog=True)
+    query_result_count = run_db_query(count_reviews_query, variables, steam_appid=steam_appid, attach_catalog=True)[0][0]
+    positive_review_count = run_db_query(count_positive_reviews_query, variables, steam_appid=steam_appid, attach_catalog=True)[0][0] or 0
 
     return reviews, query_result_count, positive_review_count
 
 def get_reviews_for_app_and_language(steam_appid, lang_key=None, day_limit=None):
-    columns = ", ".join([
+    columns = ", ".join(compat_column(col) for col in [
         "id",
         "recommended",
         "user_name",
@@ -275,10 +580,10 @@ def get_reviews_for_app_and_language(steam_appid, lang_key=None, day_limit=None)
         data = data + (lang_key,)
 
     if day_limit is not None:
-        query += " AND date_updated > utc_now() - interval '? days'"
-        data = data + (day_limit,)
+        query += " AND date_updated > ?"
+        data = data + (int(time.time()) - day_limit * 24 * 60 * 60,)
 
-    return run_db_query(query, data)
+    return run_db_query(query, data, steam_appid=steam_appid)
     #return run_db_query("SELECT " + columns + " FROM stats_steam_reviews WHERE steam_appid = %s AND lang_key = %s", (steam_appid, lang_key))
 
 def get_reviews_select_query(select, where, order, pagination):
@@ -287,53 +592,376 @@ def get_reviews_select_query(select, where, order, pagination):
 
 def get_total_review_count(steam_appid, language=None):
     if language:
-        q_lang_count = run_db_query("SELECT count(id) FROM stats_steam_reviews WHERE steam_appid = ? AND lang_key = ?;", (steam_appid, language))
+        q_lang_count = run_db_query("SELECT count(id) FROM stats_steam_reviews WHERE steam_appid = ? AND lang_key = ?;", (steam_appid, language), steam_appid=steam_appid)
         if q_lang_count:
             return q_lang_count[0][0]
-    q_review_count = run_db_query("SELECT count(id) FROM stats_steam_reviews WHERE steam_appid = ?;", (steam_appid,))
+    q_review_count = run_db_query("SELECT count(id) FROM stats_steam_reviews WHERE steam_appid = ?;", (steam_appid,), steam_appid=steam_appid)
     if q_review_count:
         return q_review_count[0][0]
     return 0
 
+def get_events(steam_appid):
+    ''' Returns (id, name, type, time_stamp) of the app's stats_events, oldest first, with time_stamp as epoch seconds. '''
+    events = run_db_query("SELECT id, name, type, {0} AS event_time FROM stats_events WHERE steam_appid = ? ORDER BY event_time, id;".format(epoch_sql("time_stamp")), (steam_appid,), steam_appid=steam_appid)
+    for event_id, name, _, event_time in events:
+        if event_time is None:
+            logging.warning("Skipping event {0} '{1}' of {2}, its time_stamp isn't a date".format(event_id, name, steam_appid))
+    return [event for event in events if event[3] is not None]
+
+def get_review_window_stats(steam_appid, from_epoch, until_epoch):
+    ''' Returns (lang_key, review count, positive count, playtime sum) per language of the app's reviews posted in
+    [from_epoch, until_epoch). The range is answered from the (steam_appid, date_posted) index.
+    '''
+    return run_db_query("SELECT lang_key, count(id), sum(recommended), sum(hours_played) FROM stats_steam_reviews WHERE steam_appid = ? AND date_posted >= ? AND date_posted < ? GROUP BY lang_key;", (steam_appid, from_epoch, until_epoch), steam_appid=steam_appid)
+
 def apply_optimizations(cursor):
     # PRAGMA statements to optimize SQLite performance
     pass
 
-def create_database():
-    db_file = "steam.db"
+def is_sharded():
+    return common.get_settings().get("db_layout", "single") == "sharded"
 
+def get_db_file(steam_appid=None):
+    ''' Returns the database file holding the data of steam_appid. In the sharded layout every app has its own file and
+    the shared tables (games, languages, issues, users) live in the catalog, which is what steam_appid=None refers to.
+    '''
+    if not is_sharded():
+        return k_db_file
+    if steam_appid is None:
+        return k_db_catalog_file
+    return k_db_shard_file_format.format(int(steam_appid))
+
+def get_sharded_appids():
+    ''' Returns the app IDs that have a database file in the sharded layout. '''
+    prefix, suffix = k_db_shard_file_format.split("{0}")
+    appids = []
+    for file_name in os.listdir("."):
+        appid = file_name[len(prefix):-len(suffix)]
+        if file_name.startswith(prefix) and file_name.endswith(suffix) and appid.isdigit():
+            appids.append(int(appid))
+    return sorted(appids)
+
+def create_database_file(db_file, tables):
     if os.path.isfile(db_file):
-        logging.info("Database file already existed, skipping database creation")
+        logging.info("Database file {0} already existed, skipping database creation".format(db_file))
     else:
         conn = sqlite3.connect(db_file)
         conn.text_factory = str
         c = conn.cursor()
 
         # Create tables
-        c.execute(db_definition.STATS_EVENTS)
-        c.execute(db_definition.STATS_STEAM_GAMES)
-        c.execute(db_definition.STATS_STEAM_LANGUAGES)
-        c.execute(db_definition.STATS_STEAM_PLAYER_COUNT)
-        c.execute(db_definition.STATS_STEAM_REVIEWS)
-        c.execute(db_definition.STAT_STEAM_REVIEW_ISSUES)
-        c.execute(db_definition.STAT_USERS)
+        for table in tables:
+            c.execute(table)
 
         conn.commit()
+        conn.close()
 
+def migrate_review_storage(conn):
+    ''' Converts stats_steam_reviews from the original layout (datetime text, steamid text, stored review url) to the
+    compact one in db_definition. Runs once per database, tracked with PRAGMA user_version.
+    '''
+    if conn.execute("PRAGMA user_version;").fetchone()[0] >= k_review_storage_version:
+        return
+
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(stats_steam_reviews);")]
+    if "review_url" in columns:
+        logging.info("Converting stats_steam_reviews to the compact storage layout, this can take a while")
+        old_isolation_level = conn.isolation_level
+        # Manage the transaction ourselves, python 2 would commit before every DDL statement
+        conn.isolation_level = None
+        conn.execute("BEGIN;")
+        try:
+            conn.execute("ALTER TABLE stats_steam_reviews RENAME TO stats_steam_reviews_old;")
+            conn.execute(db_definition.STATS_STEAM_REVIEWS)
+            conn.execute("""INSERT INTO stats_steam_reviews (id, recommended, user_name, review_text, hours_played, date_posted, date_updated, helpful_amount, helpful_total, owned_games_amount, responded_by, responded_timestamp, issue_list, can_be_turned, steam_appid, lang_key, received_compensation)
+                SELECT id, CAST(recommended AS INTEGER), CAST(user_name AS INTEGER), review_text, hours_played,
+                    CAST(strftime('%s', date_posted, 'utc') AS INTEGER), CAST(strftime('%s', date_updated, 'utc') AS INTEGER),
+                    helpful_amount, helpful_total, owned_games_amount, responded_by, CAST(strftime('%s', responded_timestamp, 'utc') AS INTEGER),
+                    issue_list, CAST(can_be_turned AS INTEGER), steam_appid, lang_key, CAST(received_compensation AS INTEGER)
+                FROM stats_steam_reviews_old;""")
+            conn.execute("DROP TABLE stats_steam_reviews_old;")
+            conn.execute("PRAGMA user_version = {0};".format(k_review_storage_version))
+            conn.execute("COMMIT;")
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+        # Give the space of the old rows back
+        conn.execute("VACUUM;")
+        conn.isolation_level = old_isolation_level
+    else:
+        conn.execute("PRAGMA user_version = {0};".format(k_review_storage_version))
+        conn.commit()
+
+def has_duplicate_issue_names(c):
+    ''' Logs the issue names that are in stats_steam_review_issues more than once, which the unique index on the name
+    can't be created over. They have to be merged by hand, as the reviews' issue_list may refer to every id.
+    '''
+    duplicates = c.execute("SELECT name, group_concat(id, ', ') FROM stats_steam_review_issues GROUP BY name HAVING count(id) > 1;").fetchall()
+    for name, issue_ids in duplicates:
+        logging.error("Issue '{0}' is in stats_steam_review_issues more than once (ids {1}), not adding the unique index on the issue name".format(name, issue_ids))
+    return bool(duplicates)
+
+def create_catalog_tables(db_file):
     conn = sqlite3.connect(db_file)
     c = conn.cursor()
+    # Catalog tables and indexes added after the first release, created on existing databases as well
+    for table in db_definition.CATALOG_TABLES_ADDED:
+        if table == db_definition.STAT_STEAM_REVIEW_ISSUES_NAME_INDEX and has_duplicate_issue_names(c):
+            continue
+        c.execute(table)
+    conn.commit()
+    conn.close()
+
+def create_app_tables(db_file):
+    conn = sqlite3.connect(db_file)
+    migrate_review_storage(conn)
+    c = conn.cursor()
+    # Tables added after the first release, created on existing databases as well
+    for table in db_definition.APP_TABLES_ADDED:
+        c.execute(table)
+    conn.commit()
     apply_optimizations(c)
 
     conn.close()
 
-def run_db_query(query, data=None, many=False):
-    db_file = "steam.db"
+def create_database(steam_appid=None):
+    ''' Creates the database files that are missing. In the sharded layout that is the catalog and, if steam_appid is
+    given, the database of that app. Raises if steam.db exists but hasn't been migrated to the sharded layout yet.
+    '''
+    if not is_sharded():
+        create_database_file(k_db_file, db_definition.CATALOG_TABLES + db_definition.APP_TABLES)
+        create_catalog_tables(k_db_file)
+        create_app_tables(k_db_file)
+        return
+
+    if os.path.isfile(k_db_file) and not os.path.isfile(k_db_catalog_file):
+        # Starting over with empty app databases would scrape everything again and leave steam.db unused
+        raise Exception("{0} is in the single layout, run migrate_db_layout.py before using the sharded layout.".format(k_db_file))
+    create_database_file(k_db_catalog_file, db_definition.CATALOG_TABLES)
+    create_catalog_tables(k_db_catalog_file)
+    if steam_appid is not None:
+        db_file = get_db_file(steam_appid)
+        create_database_file(db_file, db_definition.APP_TABLES)
+        create_app_tables(db_file)
+
+def migrate_to_sharded_layout():
+    ''' Copies the contents of the single steam.db into the catalog and one database per app. steam.db is left as it is.
+    The change log keeps its sequence numbers, so the change consumer offsets are copied into every app database.
+    The catalog is written last, under a temporary name, so it only exists once every app has been copied. A migration
+    that was interrupted is simply run again.
+    '''
+    if not os.path.isfile(k_db_file):
+        raise Exception("SQLite database file does not exist.")
+    if os.path.isfile(k_db_catalog_file):
+        raise Exception("{0} already exists, the database is in the sharded layout.".format(k_db_catalog_file))
+
+    # The app databases are created in the current layout, bring steam.db up to date first
+    create_app_tables(k_db_file)
+    conn = sqlite3.connect(k_db_file)
+    appids = [row[0] for row in conn.execute("SELECT steam_appid FROM stats_steam_reviews UNION SELECT steam_appid FROM stats_events UNION SELECT steam_appid FROM stats_steam_player_count;") if row[0] is not None]
+    conn.close()
+
+    for steam_appid in appids:
+        db_file = k_db_shard_file_format.format(int(steam_appid))
+        create_database_file(db_file, db_definition.APP_TABLES)
+        create_app_tables(db_file)
+        conn = sqlite3.connect(db_file)
+        conn.execute("ATTACH DATABASE ? AS legacy;", (k_db_file,))
+        for table in k_app_table_names:
+            conn.execute("INSERT OR IGNORE INTO main.{0} SELECT * FROM legacy.{0} WHERE steam_appid = ?;".format(table), (steam_appid,))
+        conn.execute("INSERT OR IGNORE INTO main.stats_review_change_consumers SELECT * FROM legacy.stats_review_change_consumers;")
+        conn.commit()
+        conn.close()
+        logging.info("Copied app {0} to {1}".format(steam_appid, db_file))
+
+    tmp_catalog_file = k_db_catalog_file + ".tmp"
+    if os.path.isfile(tmp_catalog_file):
+        os.remove(tmp_catalog_file)
+    create_database_file(tmp_catalog_file, db_definition.CATALOG_TABLES)
+    conn = sqlite3.connect(tmp_catalog_file)
+    conn.execute("ATTACH DATABASE ? AS legacy;", (k_db_file,))
+    for table in k_catalog_table_names:
+        conn.execute("INSERT OR IGNORE INTO main.{0} SELECT * FROM legacy.{0};".format(table))
+    conn.commit()
+    conn.close()
+    create_catalog_tables(tmp_catalog_file)
+    os.rename(tmp_catalog_file, k_db_catalog_file)
+    logging.info("Copied the shared tables to {0}".format(k_db_catalog_file))
+
+def run_single_layout_query_per_app(query, data, steam_appids):
+    conn = sqlite3.connect(k_db_file)
+    conn.text_factory = str
+    try:
+        if steam_appids is None:
+            union = " UNION ".join("SELECT steam_appid FROM {0}".format(table) for table in ["stats_steam_games"] + k_app_table_names)
+            steam_appids = [row[0] for row in conn.execute("SELECT steam_appid FROM ({0}) WHERE steam_appid IS NOT NULL ORDER BY steam_appid;".format(union))]
+
+        rows = []
+        for steam_appid in steam_appids:
+            for table in k_app_table_names:
+                conn.execute("CREATE TEMP VIEW {0} AS SELECT * FROM main.{0} WHERE steam_appid = {1};".format(table, int(steam_appid)))
+            try:
+                rows.extend(conn.execute(query.format(db="temp"), data or ()).fetchall())
+            finally:
+                for table in k_app_table_names:
+                    conn.execute("DROP VIEW temp.{0};".format(table))
+    finally:
+        conn.close()
+    return rows
+
+def run_cross_app_query(query, data=None, steam_appids=None):
+    ''' Runs a read query over the data of several apps and returns the rows of all of them.
+    The app tables are referenced as {db}.table, the catalog tables can be used unqualified, for example:
+        SELECT g.display_name, count(re.id) FROM {db}.stats_steam_reviews AS re JOIN stats_steam_games AS g ON g.steam_appid = re.steam_appid GROUP BY g.display_name
+    The query runs once per app (all apps with data, or only those of steam_appids) and the rows of all runs are
+    returned, so aggregates come back per app in both layouts. In the sharded layout each app database is attached to
+    the catalog in turn, in the single layout {db} is a set of temporary views of the app tables filtered on the app.
+    '''
+    if not is_sharded():
+        return run_single_layout_query_per_app(query, data, steam_appids)
+
+    if steam_appids is None:
+        steam_appids = get_sharded_appids()
+
+    rows = []
+    conn = sqlite3.connect(get_db_file())
+    conn.text_factory = str
+    try:
+        for steam_appid in steam_appids:
+            db_file = get_db_file(steam_appid)
+            if not os.path.isfile(db_file):
+                continue
+            conn.execute("ATTACH DATABASE ? AS app;", (db_file,))
+            try:
+                rows.extend(conn.execute(query.format(db="app"), data or ()).fetchall())
+            finally:
+                conn.execute("DETACH DATABASE app;")
+    finally:
+        conn.close()
+    return rows
+
+class BulkLoad(object):
+    ''' State of the bulk load in progress, see begin_bulk_load. '''
+    def __init__(self, steam_appid, conn, batch_size, deferred_indexes):
+        self.steam_appid = steam_appid
+        self.conn = conn
+        self.batch_size = batch_size
+        self.deferred_indexes = deferred_indexes
+
+# Secondary indexes that are dropped during a bulk load and built once at the end
+k_bulk_load_deferred_indexes = [
+    ("stats_steam_reviews_app_date", db_definition.STATS_STEAM_REVIEWS_APP_DATE_INDEX)
+]
+
+def is_bulk_load_unfinished(steam_appid):
+    return bool(run_db_query("SELECT 1 FROM stats_bulk_loads WHERE steam_appid = ?;", (steam_appid,), steam_appid=steam_appid))
+
+def begin_bulk_load(steam_appid):
+    ''' Switches the review writes of the app to bulk load mode, for the first import of an app without reviews:
+    - one connection is kept open for all batches, which are bulk_load_batch_size reviews and are inserted in id order.
+      That order only holds within a batch: the pages are fetched newest first, so the table isn't built by appending.
+      A checkpoint is saved with every batch, so the batches are kept small enough that a resume repeats few pages.
+    - the database is switched to write-ahead logging with synchronous=NORMAL, so a commit appends to the WAL file
+      without waiting for the disk. Every committed batch survives a crash of the process; after an OS crash or power
+      loss the last batches may be rolled back, but the database (shared with the other apps in the single layout)
+      stays consistent, and the checkpoints let the scraper resume from the last batch that was kept.
+    - in the sharded layout, where the app has the database to itself, the secondary indexes are dropped until
+      end_bulk_load builds them. In the single layout other apps keep using them, so they stay.
+    A stats_bulk_loads row marks the load as unfinished until end_bulk_load, so a restarted scraper resumes it.
+    '''
+    global g_bulk_load
+    run_db_query("INSERT OR REPLACE INTO stats_bulk_loads (steam_appid, time_stamp) VALUES (?, ?);", (int(steam_appid), int(time.time())), steam_appid=steam_appid)
+
+    conn = sqlite3.connect(get_db_file(steam_appid))
+    conn.text_factory = str
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute("PRAGMA cache_size = -{0};".format(common.get_settings().get("bulk_load_cache_mb", 256) * 1024))
+    conn.execute("PRAGMA temp_store = MEMORY;")
+
+    deferred_indexes = []
+    if is_sharded():
+        for index_name, index_definition in k_bulk_load_deferred_indexes:
+            conn.execute("DROP INDEX IF EXISTS {0};".format(index_name))
+            deferred_indexes.append(index_definition)
+        conn.commit()
+
+    g_bulk_load = BulkLoad(int(steam_appid), conn, common.get_settings().get("bulk_load_batch_size", 5000), deferred_indexes)
+    logging.info("Started bulk load for {0}".format(steam_appid))
+
+def end_bulk_load():
+    ''' Builds the deferred indexes, updates the query planner statistics and checks the database before going back to
+    the normal write path. Raises if the integrity check fails, the load then stays marked as unfinished.
+    '''
+    global g_bulk_load
+    bulk_load = g_bulk_load
+    g_bulk_load = None
+    conn = bulk_load.conn
+    try:
+        for index_definition in bulk_load.deferred_indexes:
+            conn.execute(index_definition)
+        conn.commit()
+        conn.execute("ANALYZE;")
+        conn.commit()
+
+        result = [row[0] for row in conn.execute("PRAGMA integrity_check;")]
+        if result != ["ok"]:
+            raise Exception("Integrity check failed after bulk load of {0}: {1}".format(bulk_load.steam_appid, "; ".join(result)))
+
+        # Back to normal durability for the last write of the load
+        conn.execute("PRAGMA synchronous = FULL;")
+        conn.execute("DELETE FROM stats_bulk_loads WHERE steam_appid = ?;", (bulk_load.steam_appid,))
+        conn.commit()
+        # Checkpoints the WAL into the database and goes back to the rollback journal. This needs the database to
+        # ourselves, while another connection has it open it stays in WAL mode, which is just as safe.
+        try:
+            conn.execute("PRAGMA journal_mode = DELETE;")
+        except sqlite3.OperationalError as e:
+            logging.warning("Database of {0} stays in WAL mode: {1}".format(bulk_load.steam_appid, e))
+    finally:
+        conn.close()
+    logging.info("Finished bulk load for {0}".format(bulk_load.steam_appid))
+
+@contextlib.contextmanager
+def db_transaction(steam_appid=None):
+    ''' Yields a cursor, everything executed on it is committed together or rolled back if an exception is raised. '''
+    if g_bulk_load is not None and steam_appid is not None and int(steam_appid) == g_bulk_load.steam_appid:
+        try:
+            yield g_bulk_load.conn.cursor()
+            g_bulk_load.conn.commit()
+        except Exception:
+            g_bulk_load.conn.rollback()
+            raise
+        return
+
+    db_file = get_db_file(steam_appid)
+    if not os.path.isfile(db_file):
+        raise Exception("SQLite database file does not exist.")
+
+    conn = sqlite3.connect(db_file)
+    conn.text_factory = str
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def run_db_query(query, data=None, many=False, steam_appid=None, attach_catalog=False):
+    ''' Runs query on the database of steam_appid (see get_db_file) and returns the fetched rows.
+    - attach_catalog: In the sharded layout, attach the catalog so the query can also use the shared tables unqualified
+    '''
+    db_file = get_db_file(steam_appid)
     if not os.path.isfile(db_file):
         raise Exception("SQLite database file does not exist.")
 
 
     with sqlite3.connect(db_file) as conn:
         conn.text_factory = str
+        if attach_catalog and db_file != get_db_file():
+            conn.execute("ATTACH DATABASE ? AS catalog;", (k_db_catalog_file,))
         c = conn.cursor()
         if many and data is not None:
             c.executemany(query, data)
@@ -1,22 +1,23 @@
+# Timestamps are unix epoch seconds, user_name is the author's steamid and the booleans are 0/1. The review url is
+# derived from user_name and steam_appid when reading, see db_common.k_compat_columns.
 STATS_STEAM_REVIEWS = """CREATE TABLE "stats_steam_reviews" (
-        "id"    INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
-        "recommended"   boolean NOT NULL,
-        "user_name"     character varying,
+        "id"    INTEGER NOT NULL PRIMARY KEY,
+        "recommended"   integer NOT NULL,
+        "user_name"     integer,
         "review_text"   character varying,
-        "hours_played"  numeric,
-        "review_url"    character varying NOT NULL,
-        "date_posted"   timestamp without time zone NOT NULL,
-        "date_updated"  timestamp without time zone,
+        "hours_played"  integer,
+        "date_posted"   integer NOT NULL,
+        "date_updated"  integer,
         "helpful_amount"        integer,
         "helpful_total" integer,
         "owned_games_amount"    integer,
         "responded_by"  bigint,
-        "responded_timestamp"   timestamp without time zone,
-        "issue_list"    bigint [],
-        "can_be_turned" boolean NOT NULL DEFAULT 0,
+        "responded_timestamp"   integer,
+        "issue_list"    character varying,
+        "can_be_turned" integer NOT NULL DEFAULT 0,
         "steam_appid"   bigint,
         "lang_key"      NUMERIC,
-        "received_compensation" boolean,
+        "received_compensation" integer,
         FOREIGN KEY("lang_key") REFERENCES "stats_steam_languages"("lang_key")
 );"""
 
@@ -58,4 +59,77 @@ STATS_STEAM_GAMES = """CREATE TABLE "stats_steam_games" (
         "steam_appid"   bigint NOT NULL,
         "display_name"  character varying NOT NULL,
         PRIMARY KEY("steam_appid")
-);"""
\ No newline at end of file
+);"""
+
+STATS_SCRAPE_CHECKPOINTS = """CREATE TABLE IF NOT EXISTS "stats_scrape_checkpoints" (
+        "steam_appid"   bigint NOT NULL,
+        "sort_filter"   character varying NOT NULL,
+        "languages"     character varying NOT NULL,
+        "cursor"        character varying NOT NULL,
+        "page_count"    integer NOT NULL,
+        "num_added"     integer NOT NULL,
+        "time_stamp"    integer NOT NULL,
+        PRIMARY KEY("steam_appid")
+);"""
+
+STATS_SCRAPE_SEEN_REVIEWS = """CREATE TABLE IF NOT EXISTS "stats_scrape_seen_reviews" (
+        "steam_appid"   bigint NOT NULL,
+        "review_id"     bigint NOT NULL,
+        PRIMARY KEY("steam_appid", "review_id")
+) WITHOUT ROWID;"""
+
+STATS_STEAM_REVIEW_CHANGES = """CREATE TABLE IF NOT EXISTS "stats_steam_review_changes" (
+        "seq"   INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+        "review_id"     bigint NOT NULL,
+        "steam_appid"   bigint NOT NULL,
+        "change_type"   character varying NOT NULL,
+        "recommended"   boolean,
+        "time_stamp"    integer NOT NULL
+);"""
+
+STATS_STEAM_REVIEWS_APP_DATE_INDEX = """CREATE INDEX IF NOT EXISTS "stats_steam_reviews_app_date" ON "stats_steam_reviews" ("steam_appid", "date_posted");"""
+
+STATS_BULK_LOADS = """CREATE TABLE IF NOT EXISTS "stats_bulk_loads" (
+        "steam_appid"   bigint NOT NULL,
+        "time_stamp"    integer NOT NULL,
+        PRIMARY KEY("steam_appid")
+);"""
+
+STATS_REVIEW_CHANGE_CONSUMERS = """CREATE TABLE IF NOT EXISTS "stats_review_change_consumers" (
+        "name"  character varying NOT NULL,
+        "last_seq"      integer NOT NULL DEFAULT 0,
+        "time_stamp"    integer NOT NULL,
+        PRIMARY KEY("name")
+);"""
+
+# Tables shared by all apps, in the sharded layout they live in the catalog database
+CATALOG_TABLES = [
+    STATS_STEAM_GAMES,
+    STATS_STEAM_LANGUAGES,
+    STAT_STEAM_REVIEW_ISSUES,
+    STAT_USERS
+]
+
+STAT_STEAM_REVIEW_ISSUES_NAME_INDEX = """CREATE UNIQUE INDEX IF NOT EXISTS "stats_steam_review_issues_name" ON "stats_steam_review_issues" ("name");"""
+
+# Catalog tables and indexes added after the first release, created on existing databases as well
+CATALOG_TABLES_ADDED = [
+    STAT_STEAM_REVIEW_ISSUES_NAME_INDEX
+]
+
+# Tables with per app data, in the sharded layout every app database has them
+APP_TABLES = [
+    STATS_EVENTS,
+    STATS_STEAM_PLAYER_COUNT,
+    STATS_STEAM_REVIEWS
+]
+
+# Per app tables added after the first release, created on existing databases as well
+APP_TABLES_ADDED = [
+    STATS_SCRAPE_CHECKPOINTS,
+    STATS_SCRAPE_SEEN_REVIEWS,
+    STATS_STEAM_REVIEW_CHANGES,
+    STATS_REVIEW_CHANGE_CONSUMERS,
+    STATS_STEAM_REVIEWS_APP_DATE_INDEX,
+    STATS_BULK_LOADS
+]
\ No newline at end of file
@@ -0,0 +1,144 @@
+import csv
+import math
+import time
+import logging
+import argparse
+import datetime
+
+import common
+import db_common
+
+k_report_header = [
+    "steam_appid",
+    "event_id",
+    "event_name",
+    "event_type",
+    "event_time",
+    "window_days",
+    "reviews_before",
+    "reviews_after",
+    "positive_ratio_before",
+    "positive_ratio_after",
+    "avg_playtime_before",
+    "avg_playtime_after",
+    "languages_before",
+    "languages_after",
+    "volume_z",
+    "positive_ratio_z",
+    "significant"
+]
+
+class WindowStats(object):
+    ''' Review volume, positive ratio, playtime and language mix of the reviews posted in one time window. '''
+    def __init__(self, rows):
+        self.lang_counts = {}
+        self.count = 0
+        self.positive = 0
+        self.playtime = 0
+        for lang_key, count, positive, playtime in rows:
+            self.lang_counts[lang_key] = count
+            self.count = self.count + count
+            self.positive = self.positive + (positive or 0)
+            self.playtime = self.playtime + (playtime or 0)
+
+    def positive_ratio(self):
+        return float(self.positive) / self.count if self.count else None
+
+    def avg_playtime(self):
+        return float(self.playtime) / self.count if self.count else None
+
+    def language_mix(self, top=3):
+        ''' Returns the share of the most common languages, like "english:61%,schinese:20%". '''
+        langs = sorted(self.lang_counts.items(), key=lambda item: item[1], reverse=True)[:top]
+        return ",".join("{0}:{1:.0f}%".format(lang_key, 100.0 * count / self.count) for lang_key, count in langs)
+
+def get_window_stats(steam_appid, from_epoch, until_epoch):
+    return WindowStats(db_common.get_review_window_stats(steam_appid, from_epoch, until_epoch))
+
+def volume_z(before, after):
+    # Poisson approximation of the difference between the two review counts
+    if before.count + after.count == 0:
+        return 0.0
+    return (after.count - before.count) / math.sqrt(before.count + after.count)
+
+def positive_ratio_z(before, after):
+    # Two proportion z-test between the positive ratios
+    if not before.count or not after.count:
+        return 0.0
+    pooled = float(before.positive + after.positive) / (before.count + after.count)
+    variance = pooled * (1 - pooled) * (1.0 / before.count + 1.0 / after.count)
+    if variance <= 0:
+        return 0.0
+    return (after.positive_ratio() - before.positive_ratio()) / math.sqrt(variance)
+
+def format_ratio(value):
+    return "" if value is None else "{0:.3f}".format(value)
+
+def get_event_impact_rows(steam_appid, window_days_list, min_reviews, z_threshold):
+    ''' Returns a report row (see k_report_header) per event and window size. An event is significant when both
+    windows have at least min_reviews reviews and the volume or the positive ratio moved by z_threshold or more.
+    '''
+    rows = []
+    for event_id, name, event_type, event_time in db_common.get_events(steam_appid):
+        for window_days in window_days_list:
+            window = window_days * common.k_seconds_per_day
+            before = get_window_stats(steam_appid, event_time - window, event_time)
+            after = get_window_stats(steam_appid, event_time, event_time + window)
+            z_volume = volume_z(before, after)
+            z_ratio = positive_ratio_z(before, after)
+            significant = min(before.count, after.count) >= min_reviews and max(abs(z_volume), abs(z_ratio)) >= z_threshold
+            rows.append([
+                steam_appid,
+                event_id,
+                name,
+                event_type,
+                datetime.datetime.fromtimestamp(event_time),
+                window_days,
+                before.count,
+                after.count,
+                format_ratio(before.positive_ratio()),
+                format_ratio(after.positive_ratio()),
+                format_ratio(before.avg_playtime()),
+                format_ratio(after.avg_playtime()),
+                before.language_mix(),
+                after.language_mix(),
+                "{0:.2f}".format(z_volume),
+                "{0:.2f}".format(z_ratio),
+                int(significant)
+            ])
+    return rows
+
+def main(options):
+    appids = [options.app] if options.app else [app.appid for app in common.get_settings().get_tracked_apps()]
+    window_days_list = options.window_days or [7, 30]
+
+    with open(options.output, "w") as output_file:
+        writer = csv.writer(output_file, delimiter=";")
+        writer.writerow(k_report_header)
+        for steam_appid in appids:
+            rows = get_event_impact_rows(steam_appid, window_days_list, options.min_reviews, options.z_threshold)
+            writer.writerows(rows)
+            logging.info("{0}: {1} event windows, {2} significant".format(steam_appid, len(rows), sum(row[-1] for row in rows)))
+    logging.info("Wrote report to {0}".format(options.output))
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compares the reviews posted before and after every patch or other event in stats_events and flags the events with significant shifts")
+    parser.add_argument("-a", "--app", help="Only report on this app ID, instead of all tracked apps")
+    parser.add_argument("-w", "--window-days", type=int, action="append", help="Size of the before and after windows in days, can be given several times (default 7 and 30)")
+    parser.add_argument("-m", "--min-reviews", type=int, default=30, help="Reviews needed in both windows before an event can be flagged")
+    parser.add_argument("-z", "--z-threshold", type=float, default=1.96, help="z-score from which a shift counts as significant")
+    parser.add_argument("-o", "--output", default="event_impact_report.csv", help="csv file to write the report to")
+    parser.add_argument("-s", "--silent", action="store_true", help="If set, only errors will be printed")
+    options = parser.parse_args()
+
+    log_level = "INFO"
+    if options.silent:
+        log_level = "ERROR"
+    common.init_logging("event-impact-report.log", log_level)
+    start_time = time.time()
+    ret = main(options)
+    if ret != 0:
+        logging.error("main() returned {0}".format(ret))
+    logging.info("Done, total time elapsed: {0}".format(common.pretty_time(time.time() - start_time)))
@@ -0,0 +1,27 @@
+import time
+import logging
+import argparse
+
+import common
+import db_common
+
+def main(options):
+    db_common.migrate_to_sharded_layout()
+    logging.info("Migrated {0} to the sharded layout, set \"db_layout\": \"sharded\" in the settings file to use it".format(db_common.k_db_file))
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copies the single steam.db into the catalog and one database per app, for the sharded db_layout. steam.db is left as it is")
+    parser.add_argument("-s", "--silent", action="store_true", help="If set, only errors will be printed")
+    options = parser.parse_args()
+
+    log_level = "INFO"
+    if options.silent:
+        log_level = "ERROR"
+    common.init_logging("migrate-db-layout.log", log_level)
+    start_time = time.time()
+    ret = main(options)
+    if ret != 0:
+        logging.error("main() returned {0}".format(ret))
+    logging.info("Done, total time elapsed: {0}".format(common.pretty_time(time.time() - start_time)))
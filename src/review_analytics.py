@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import logging
+import calendar
+import datetime
+
+import numpy as np
+
+import common
+import db_common
+
+k_snapshot_dir = "analytics_snapshots"
+
+# One record per review, ordered by timestamp
+k_snapshot_dtype = np.dtype([
+    ("id", np.int64),
+    ("timestamp", np.int64),
+    ("recommended", np.int8),
+    ("hours_played", np.float32),
+    ("helpful_amount", np.int32),
+    ("helpful_total", np.int32),
+    ("lang_code", np.int16),
+    ("owned_games", np.int32)
+])
+
+k_snapshot_columns = ", ".join([
+    "id",
+    "COALESCE({0}, 0)".format(db_common.epoch_sql("date_posted")),
+    "recommended",
+    "COALESCE(hours_played, 0)",
+    "COALESCE(helpful_amount, 0)",
+    "COALESCE(helpful_total, 0)",
+    "lang_key",
+    "COALESCE(owned_games_amount, 0)"
+])
+
+class ReviewSnapshot(object):
+    ''' Numeric review columns of one app.
+    - reviews: array of k_snapshot_dtype records, memory mapped from the snapshot file
+    - lang_keys: lang_code i of a review is lang_keys[i], -1 for languages that aren't in the settings
+    '''
+    def __init__(self, steam_appid, reviews, lang_keys, last_seq):
+        self.steam_appid = steam_appid
+        self.reviews = reviews
+        self.lang_keys = lang_keys
+        self.last_seq = last_seq
+
+    def language_mask(self, lang_key):
+        if lang_key not in self.lang_keys:
+            return np.zeros(len(self.reviews), dtype=bool)
+        return self.reviews["lang_code"] == self.lang_keys.index(lang_key)
+
+def get_snapshot_paths(steam_appid):
+    base_path = os.path.join(k_snapshot_dir, "reviews_{0}".format(int(steam_appid)))
+    return base_path + ".npy", base_path + ".json"
+
+def get_lang_keys():
+    return sorted(common.get_settings().languages.keys())
+
+def rows_to_records(rows, lang_keys):
+    lang_codes = {lang_key: code for code, lang_key in enumerate(lang_keys)}
+    rows = [row[:6] + (lang_codes.get(row[6], -1), row[7]) for row in rows]
+    return np.array(rows, dtype=k_snapshot_dtype)
+
+def load_review_records(steam_appid, lang_keys, review_ids=None):
+    query = "SELECT {0} FROM stats_steam_reviews WHERE steam_appid = ?".format(k_snapshot_columns)
+    if review_ids is None:
+        rows = db_common.run_db_query(query + ";", (steam_appid,), steam_appid=steam_appid)
+        return rows_to_records(rows, lang_keys)
+
+    rows = []
+    review_ids = list(review_ids)
+    for start in range(0, len(review_ids), db_common.k_change_lookup_chunk):
+        chunk = review_ids[start:start + db_common.k_change_lookup_chunk]
+        chunk_query = query + " AND id IN ({0});".format(", ".join(["?"] * len(chunk)))
+        rows.extend(db_common.run_db_query(chunk_query, (steam_appid,) + tuple(chunk), steam_appid=steam_appid))
+    return rows_to_records(rows, lang_keys)
+
+def save_snapshot(steam_appid, reviews, lang_keys, last_seq):
+    data_path, meta_path = get_snapshot_paths(steam_appid)
+    if not os.path.exists(k_snapshot_dir):
+        os.makedirs(k_snapshot_dir)
+
+    reviews = reviews[np.argsort(reviews["timestamp"], kind="mergesort")]
+    # np.save adds the .npy extension itself
+    tmp_path = data_path[:-len(".npy")] + ".tmp"
+    np.save(tmp_path, reviews)
+    # rename replaces the old file atomically, readers see either the old or the new snapshot
+    os.rename(tmp_path + ".npy", data_path)
+
+    tmp_meta_path = meta_path + ".tmp"
+    with open(tmp_meta_path, "w") as meta_file:
+        json.dump({"last_seq": last_seq, "lang_keys": lang_keys, "built_at": int(time.time())}, meta_file)
+    os.rename(tmp_meta_path, meta_path)
+
+def build_snapshot(steam_appid):
+    ''' Writes a new snapshot of all the app's reviews. '''
+    lang_keys = get_lang_keys()
+    # Read the log position first, changes made while we load are picked up by the next refresh
+    last_seq = db_common.get_last_review_change_seq(steam_appid)
+    reviews = load_review_records(steam_appid, lang_keys)
+    save_snapshot(steam_appid, reviews, lang_keys, last_seq)
+    logging.info("Built review snapshot for {0} ({1} reviews)".format(steam_appid, len(reviews)))
+
+def refresh_snapshot(steam_appid, meta):
+    ''' Applies the change log records after the snapshot's last_seq. Returns False if there were none. '''
+    changed_ids = set()
+    last_seq = meta["last_seq"]
+    while True:
+        changes = db_common.get_review_changes_since(last_seq, 10000, steam_appid)
+        if not changes:
+            break
+        changed_ids.update(change[1] for change in changes)
+        last_seq = changes[-1][0]
+
+    if not changed_ids:
+        return False
+
+    data_path, _ = get_snapshot_paths(steam_appid)
+    reviews = np.load(data_path)
+    # Deleted reviews are simply not found again, the others are replaced by their current row
+    kept = reviews[~np.isin(reviews["id"], np.array(list(changed_ids), dtype=np.int64))]
+    reloaded = load_review_records(steam_appid, meta["lang_keys"], changed_ids)
+    save_snapshot(steam_appid, np.concatenate([kept, reloaded]), meta["lang_keys"], last_seq)
+    logging.info("Refreshed review snapshot for {0} ({1} changed reviews)".format(steam_appid, len(changed_ids)))
+    return True
+
+def load_snapshot(steam_appid, refresh=True):
+    ''' Returns the ReviewSnapshot of the app, building it the first time.
+    - refresh: Apply the changes logged since the snapshot was written. Helpful votes and playtime aren't in the change
+      log, so the snapshot is rebuilt completely once it is older than analytics_snapshot_max_age_hours.
+    '''
+    data_path, meta_path = get_snapshot_paths(steam_appid)
+    meta = None
+    if os.path.isfile(data_path) and os.path.isfile(meta_path):
+        with open(meta_path, "r") as meta_file:
+            meta = json.load(meta_file)
+
+    max_age = common.get_settings().get("analytics_snapshot_max_age_hours", 24) * 60 * 60
+    if meta is None or meta["lang_keys"] != get_lang_keys() or time.time() - meta["built_at"] > max_age:
+        build_snapshot(steam_appid)
+    elif refresh:
+        refresh_snapshot(steam_appid, meta)
+
+    with open(meta_path, "r") as meta_file:
+        meta = json.load(meta_file)
+    return ReviewSnapshot(steam_appid, np.load(data_path, mmap_mode="r"), meta["lang_keys"], meta["last_seq"])
+
+def local_utc_offsets(timestamps):
+    ''' Returns the local UTC offset in seconds at each timestamp. It is looked up once per hour the timestamps fall
+    in, which is as often as daylight saving time changes it.
+    '''
+    hours, inverse = np.unique(timestamps // 3600, return_inverse=True)
+    offsets = np.array([calendar.timegm(time.localtime(hour * 3600)) - hour * 3600 for hour in hours], dtype=np.int64)
+    return offsets[inverse]
+
+def rolling_positive_ratio(reviews, window_days=30):
+    ''' Returns (day_starts, ratios): for every day from the first to the last review, the share of positive reviews
+    posted in the window_days up to and including that day. Days without reviews in the window are nan.
+    Days are local calendar days, like the dates get_reviews returns, and day_starts are their local midnights.
+    '''
+    if len(reviews) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+    timestamps = reviews["timestamp"]
+    days = (timestamps + local_utc_offsets(timestamps)) // common.k_seconds_per_day
+    first_day = days.min()
+    day_index = days - first_day
+    num_days = int(day_index.max()) + 1
+
+    positive = np.cumsum(np.bincount(day_index, weights=reviews["recommended"], minlength=num_days))
+    total = np.cumsum(np.bincount(day_index, minlength=num_days))
+    positive = np.concatenate([[0], positive])
+    total = np.concatenate([[0], total])
+
+    window_start = np.maximum(np.arange(num_days) + 1 - window_days, 0)
+    window_positive = positive[1:] - positive[window_start]
+    window_total = total[1:] - total[window_start]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(window_total > 0, window_positive / window_total, np.nan)
+
+    epoch_date = datetime.date(1970, 1, 1)
+    day_starts = np.array([time.mktime((epoch_date + datetime.timedelta(days=int(day))).timetuple()) for day in first_day + np.arange(num_days)], dtype=np.int64)
+    return day_starts, ratios
+
+def playtime_histogram(reviews, bins=20, max_hours=None):
+    ''' Returns (counts, bin_edges) of hours_played at the time of the review. '''
+    hours_played = reviews["hours_played"]
+    if max_hours is not None:
+        hours_played = hours_played[hours_played <= max_hours]
+    return np.histogram(hours_played, bins=bins)
+
+def helpfulness_percentiles(reviews, percentiles=(50, 90, 99)):
+    ''' Returns the given percentiles of helpful_amount / helpful_total, over the reviews that got any votes. '''
+    voted = reviews[reviews["helpful_total"] > 0]
+    if len(voted) == 0:
+        return np.full(len(percentiles), np.nan)
+    return np.percentile(voted["helpful_amount"] / voted["helpful_total"].astype(np.float64), percentiles)
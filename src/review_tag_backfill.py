@@ -0,0 +1,90 @@
+import time
+import logging
+import argparse
+import multiprocessing
+
+import common
+import db_common
+import review_tagger
+
+g_tagger = None
+
+def init_worker(rules, issue_ids):
+    # Every worker compiles the rules once, the chunks only carry the reviews
+    global g_tagger
+    g_tagger = review_tagger.IssueTagger(rules, issue_ids)
+
+def tag_chunk(rows):
+    ''' Returns (issue_list, id) for the reviews in rows whose issue_list gains issues. '''
+    updates = []
+    for review_id, lang_key, review_text, issue_list in rows:
+        new_issue_list = review_tagger.merge_issue_list(issue_list, g_tagger.tag(lang_key, review_text))
+        if new_issue_list != issue_list:
+            updates.append((new_issue_list, review_id))
+    return updates
+
+def backfill_app(steam_appid, pool, chunk_size, chunks_per_round):
+    ''' Tags all stored reviews of the app. The chunks are read in id order, a round of them is tagged by the pool and
+    the results are written in one transaction before the next round is read, so memory use stays bounded.
+    '''
+    last_id = 0
+    num_reviews = 0
+    num_tagged = 0
+    while True:
+        chunks = []
+        for _ in range(chunks_per_round):
+            rows = db_common.run_db_query("SELECT id, lang_key, review_text, issue_list FROM stats_steam_reviews WHERE steam_appid = ? AND id > ? ORDER BY id LIMIT ?;", (steam_appid, last_id, chunk_size), steam_appid=steam_appid)
+            if not rows:
+                break
+            chunks.append(rows)
+            last_id = rows[-1][0]
+        if not chunks:
+            break
+
+        updates = [update for chunk_updates in pool.map(tag_chunk, chunks) for update in chunk_updates]
+        if updates:
+            with db_common.db_transaction(steam_appid) as c:
+                c.executemany("UPDATE stats_steam_reviews SET issue_list = ? WHERE id = ?;", updates)
+        num_reviews = num_reviews + sum(len(chunk) for chunk in chunks)
+        num_tagged = num_tagged + len(updates)
+        logging.info("{0}: {1} reviews checked, {2} got new issues".format(steam_appid, num_reviews, num_tagged))
+
+    return num_tagged
+
+def main(options):
+    rules = review_tagger.get_issue_rules()
+    if not rules:
+        logging.error("No issue_rules in the settings file.")
+        return 1
+
+    issue_ids = db_common.get_or_create_issue_ids(review_tagger.get_issue_names(rules))
+    appids = [options.app] if options.app else [app.appid for app in common.get_settings().get_tracked_apps()]
+
+    pool = multiprocessing.Pool(options.processes, init_worker, (rules, issue_ids))
+    try:
+        for steam_appid in appids:
+            num_tagged = backfill_app(steam_appid, pool, options.chunk_size, options.processes * 2)
+            logging.info("Tagged {0} reviews for {1}".format(num_tagged, steam_appid))
+    finally:
+        pool.close()
+        pool.join()
+
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tags the stored reviews with the issues their text matches, using the issue_rules of the settings file")
+    parser.add_argument("-a", "--app", help="Only tag the reviews of this app ID, instead of all tracked apps")
+    parser.add_argument("-p", "--processes", type=int, default=multiprocessing.cpu_count(), help="Number of worker processes")
+    parser.add_argument("-c", "--chunk-size", type=int, default=2000, help="Number of reviews per worker task")
+    parser.add_argument("-s", "--silent", action="store_true", help="If set, only errors will be printed")
+    options = parser.parse_args()
+
+    log_level = "INFO"
+    if options.silent:
+        log_level = "ERROR"
+    common.init_logging("review-tag-backfill.log", log_level)
+    start_time = time.time()
+    ret = main(options)
+    if ret != 0:
+        logging.error("main() returned {0}".format(ret))
+    logging.info("Done, total time elapsed: {0}".format(common.pretty_time(time.time() - start_time)))
@@ -0,0 +1,78 @@
+import re
+import json
+import collections
+
+import common
+
+k_all_languages = "all" # Rules under this key apply to every language
+
+def parse_issue_list(value):
+    ''' Returns the issue IDs of a stored issue_list (a JSON array, or NULL). '''
+    if isinstance(value, bytes):
+        value = value.decode("utf-8")
+    if not value:
+        return []
+    return json.loads(value)
+
+def merge_issue_list(value, issue_ids):
+    ''' Returns the stored issue_list with issue_ids added, unchanged if they were all there already. '''
+    current = parse_issue_list(value)
+    merged = sorted(set(current) | set(issue_ids))
+    if merged == sorted(current):
+        return value
+    return json.dumps(merged)
+
+def get_issue_rules():
+    return common.get_settings().get("issue_rules", {})
+
+def get_issue_names(rules):
+    return sorted({rule["issue"] for lang_key in rules for rule in rules[lang_key]})
+
+class IssueTagger(object):
+    ''' Finds the issues a review text mentions using the issue_rules of settings.json:
+        "issue_rules": {"english": [{"issue": "Crashes", "keywords": ["crash"], "regex": ["black\\s+screen"]}]}
+    Keywords match case insensitively as whole words, unless the rule sets "whole_word": false (for languages without
+    spaces between words). The rules of a language, plus those under "all", are compiled once into a pattern per issue
+    and one combined pattern over all issues. Most reviews match no rule, and for those the combined pattern is the
+    only scan; the others are checked against each issue's own pattern, so matches of different issues may overlap.
+    - issue_ids: issue name -> stats_steam_review_issues id
+    '''
+    def __init__(self, rules, issue_ids):
+        shared_rules = rules.get(k_all_languages, [])
+        self.patterns = {}
+        for lang_key in rules:
+            if lang_key != k_all_languages:
+                self.patterns[lang_key] = self.compile(rules[lang_key] + shared_rules, issue_ids)
+        self.default_pattern = self.compile(shared_rules, issue_ids)
+
+    @staticmethod
+    def compile(rules, issue_ids):
+        ''' Returns (combined pattern, [(issue id, issue pattern)]), or None if the rules have nothing to match. '''
+        alternatives_by_issue = collections.OrderedDict()
+        for rule in rules:
+            word_format = r"\b{0}\b" if rule.get("whole_word", True) else "{0}"
+            alternatives = alternatives_by_issue.setdefault(issue_ids[rule["issue"]], [])
+            alternatives.extend(word_format.format(re.escape(keyword)) for keyword in rule.get("keywords", []))
+            alternatives.extend(rule.get("regex", []))
+
+        issue_patterns = []
+        for issue_id, alternatives in alternatives_by_issue.items():
+            if alternatives:
+                issue_patterns.append((issue_id, "|".join("(?:{0})".format(alternative) for alternative in alternatives)))
+        if not issue_patterns:
+            return None
+        flags = re.IGNORECASE | re.UNICODE
+        combined = re.compile("|".join("(?:{0})".format(pattern) for _, pattern in issue_patterns), flags)
+        return combined, [(issue_id, re.compile(pattern, flags)) for issue_id, pattern in issue_patterns]
+
+    def tag(self, lang_key, review_text):
+        ''' Returns the sorted IDs of the issues the text matches. '''
+        patterns = self.patterns.get(lang_key, self.default_pattern)
+        if patterns is None or not review_text:
+            return []
+        if isinstance(review_text, bytes):
+            review_text = review_text.decode("utf-8")
+        combined, issue_patterns = patterns
+        if not combined.search(review_text):
+            return []
+        return sorted(issue_id for issue_id, pattern in issue_patterns if pattern.search(review_text))
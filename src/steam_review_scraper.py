@@ -168,11 +168,23 @@ def review_parse_loop(appid, languages, sort_by, save_to_db):
     language_keys = [lang.steam_key for lang in languages]
     total_reviews = "Unknown"
     num_added = 0
+    page_count = 0
     percent = 0
 
+    if save_to_db:
+        max_age = common.get_settings().get("scrape_checkpoint_max_age_hours", 24) * 60 * 60
+        checkpoint = db_common.get_scrape_checkpoint(appid, sort_by, ','.join(language_keys), max_age)
+        if checkpoint:
+            logging.info("Resuming from checkpoint at page {} ({} reviews already saved)".format(checkpoint.page_count, checkpoint.num_added))
+            current_cursor = checkpoint.cursor
+            page_count = checkpoint.page_count
+            num_added = checkpoint.num_added
+            seen_cursors.add(current_cursor)
+
     while True:
         reviews, current_cursor, t = get_reviews_from_api(appid, language_keys, 100, sort_by, current_cursor)
         num_added = num_added + len(reviews)
+        page_count = page_count + 1
 
         if t is not None:
             total_reviews = t
@@ -181,7 +193,8 @@ def review_parse_loop(appid, languages, sort_by, save_to_db):
             percent = round((float(num_added) / float(total_reviews)) * 100)
 
         if save_to_db:
-            db_common.insert_or_update_reviews(reviews, include_user_input_columns=False)
+            checkpoint = db_common.ScrapeCheckpoint(appid, sort_by, ','.join(language_keys), current_cursor, page_count, num_added)
+            db_common.insert_or_update_reviews(reviews, include_user_input_columns=False, checkpoint=checkpoint)
 
             if num_added % 1000 == 0:
                 if os.getenv("scraper_show_progressbar", '0') == '1':
@@ -196,7 +209,8 @@ def review_parse_loop(appid, languages, sort_by, save_to_db):
         if current_cursor in seen_cursors:
             logging.info("breaking on seen cursor {}. No more reviews to add".format(current_cursor))
             # empty the queue
-            db_common.maybe_insert_batch_reviews(force_insert=True)
+            if save_to_db:
+                db_common.maybe_insert_batch_reviews(force_insert=True, checkpoint=checkpoint)
             break
 
         if current_cursor != '*':
@@ -234,9 +248,17 @@ def parse_reviews_for_app(appid, options):
     all_reviews = set()
     languages = common.get_settings().get_tracked_languages()
 
+    # The first import of an app (or one that crashed during it) goes through the bulk load path
+    bulk_load = common.get_settings().get("bulk_load_enabled", True) and (db_common.get_total_review_count(appid) == 0 or db_common.is_bulk_load_unfinished(appid))
+    if bulk_load:
+        db_common.begin_bulk_load(appid)
+
     reviews = review_parse_loop(appid, languages, k_steam_review_page_sort_filters[0], True)
     all_reviews.update(reviews)
 
+    if bulk_load:
+        db_common.end_bulk_load()
+
     for language in languages:
         db_common.insert_or_update_languages(language.lang_key, language.name, language.steam_key)
 
@@ -249,9 +271,12 @@ def parse_reviews_for_app(appid, options):
 def remove_deleted_reviews(steam_appid, recent_added_reviews):
     reviews = db_common.get_reviews_for_app_and_language(steam_appid)
 
-    added_ids = {review.id for review in recent_added_reviews}
+    # Reviews saved before an interrupted run was resumed are not in recent_added_reviews, but were recorded with the checkpoints
+    added_ids = {int(review.id) for review in recent_added_reviews}
+    added_ids.update(db_common.get_scrape_seen_review_ids(steam_appid))
 
     languages =  common.get_settings().get_tracked_languages()
+    language_keys = {language.steam_key for language in languages}
 
     logging.info("Checking for deleted reviews (for {}). Languages: {}".format(steam_appid, ','.join([language.steam_key for language in languages])))
     num_deleted = 0
@@ -260,29 +285,32 @@ def remove_deleted_reviews(steam_appid, recent_added_reviews):
         url = review[5]
         language = review[15]
 
-        if review_id not in added_ids and language in languages:
+        if review_id not in added_ids and language in language_keys:
             logging.info("Deleting review ({} for {}, language {})".format(review_id, steam_appid, language))
-            db_common.delete_review(review_id)
+            db_common.delete_review(review_id, steam_appid)
             num_deleted = num_deleted + 1
 
     logging.info("Deleted {} reviews".format(num_deleted))
 
 def main(options):
 
-    db_common.create_database()
-
     app_id = os.environ.get('APP_ID')
 
     if not app_id:
         logging.error("No APP_ID environment variable set.")
         return 1
 
+    db_common.create_database(app_id)
+
     logging.info("Parsing reviews for app ID: {0}".format(app_id))
     
     ret = parse_reviews_for_app(app_id, options)
 
     remove_deleted_reviews(app_id, ret)
 
+    # The run is complete, the next one starts from the first page again
+    db_common.clear_scrape_checkpoint(app_id)
+
     if ret != 0:
         if type(ret) is set:
             return 0
@@ -0,0 +1,31 @@
+import unittest
+
+import review_tagger
+
+class IssueTaggerTest(unittest.TestCase):
+    def make_tagger(self, *rules):
+        issue_names = [rule["issue"] for rule in rules]
+        issue_ids = {name: issue_id for issue_id, name in enumerate(issue_names, 1)}
+        return review_tagger.IssueTagger({"english": list(rules)}, issue_ids)
+
+    def test_overlapping_matches_tag_every_issue(self):
+        tagger = self.make_tagger(
+            {"issue": "Game crash", "regex": ["game crash(es)?"]},
+            {"issue": "Crash", "keywords": ["crash"]}
+        )
+        self.assertEqual(tagger.tag("english", "the game crash is bad"), [1, 2])
+
+    def test_chained_matches_tag_every_issue(self):
+        tagger = self.make_tagger(
+            {"issue": "Black screen", "keywords": ["black screen"]},
+            {"issue": "Flicker", "keywords": ["screen flicker"]}
+        )
+        self.assertEqual(tagger.tag("english", "Black screen flicker"), [1, 2])
+
+    def test_no_match_and_unknown_language(self):
+        tagger = self.make_tagger({"issue": "Crash", "keywords": ["crash"]})
+        self.assertEqual(tagger.tag("english", "crashed once"), [])
+        self.assertEqual(tagger.tag("german", "crash"), [])
+
+if __name__ == "__main__":
+    unittest.main()